@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+from pathlib import Path
+
+import orjson
+
+CACHE_FILE = (Path(__file__).parent / "cache" / "playlists.json").resolve()
+
+
+def load_cache() -> dict[str, dict]:
+    """Load the cached playlists from the last run.
+
+    Returns:
+        dict[str, dict]: The ETag and items of each playlist, keyed by the playlist ID.
+            Empty if there is no cache yet.
+    """
+    if not CACHE_FILE.exists():
+        return {}
+
+    return orjson.loads(CACHE_FILE.read_bytes())
+
+
+def save_cache(cache: dict[str, dict]):
+    """Save the cached playlists for the next run.
+
+    Args:
+        cache (dict[str, dict]): The ETag and items of each playlist, keyed by the playlist ID.
+    """
+    CACHE_FILE.parent.mkdir(exist_ok=True)
+    CACHE_FILE.write_bytes(orjson.dumps(cache))
@@ -5,14 +5,40 @@
 # Last modified by Tibor Völcker on 01.01.24
 # Copyright (c) 2023 Tibor Völcker (tiborvoelcker@hotmail.de)
 
-from datetime import date, datetime, timedelta
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, timezone
 
+import aiohttp
+import google_auth_httplib2
 import googleapiclient.discovery
+import httplib2
+import numpy as np
+import orjson
 import pandas as pd
 from auth import auth
+from cache import load_cache, save_cache
+from google.auth.transport.requests import Request
 from googleapiclient.discovery import Resource
-from tqdm import tqdm
-from wrapper import BAR_FORMAT, Wrapper
+from tqdm.asyncio import tqdm
+from wrapper import BAR_FORMAT, BAR_MININTERVAL, OrjsonModel, Wrapper, make_extractor
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+# Maximum number of concurrent requests to the API
+MAX_CONNECTIONS = 20
+# Minimum remaining lifetime of the access token used by the aiohttp session
+TOKEN_MIN_LIFETIME = timedelta(minutes=30)
+# ISO 8601 durations as returned by the API, e.g. "PT1H2M3S" or "P1DT2H"
+DURATION_PATTERN = r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?"
+
+# Extract the needed fields of each resource
+SUBSCRIPTION_EXTRACTOR = make_extractor(
+    [("snippet", "resourceId", "channelId"), ("snippet", "title")]
+)
+PLAYLIST_ITEM_EXTRACTOR = make_extractor(
+    [("contentDetails", "videoId"), ("snippet", "publishedAt")]
+)
+VIDEO_DURATION_EXTRACTOR = make_extractor([("id",), ("contentDetails", "duration")])
 
 
 def get_subscriptions(client: Resource) -> pd.DataFrame:
@@ -26,96 +52,230 @@ def get_subscriptions(client: Resource) -> pd.DataFrame:
     """
     # Retrieve the list of subscriptions
     resource = Wrapper(client.subscriptions())  # type: ignore
-    items = resource.list_all(part="snippet", mine=True)
-
-    # This flattens the entire dictionary
-    df = pd.json_normalize(items)
-    subs = pd.DataFrame()
-    subs[["channelId", "title"]] = df[["snippet.resourceId.channelId", "snippet.title"]]
+    subs = resource.list_projected(
+        SUBSCRIPTION_EXTRACTOR,
+        ["channelId", "title"],
+        part="snippet",
+        mine=True,
+    )
 
     # Get upload playlists
-    subs["uploadPlaylistId"] = get_upload_playlists(client, list(subs["channelId"]))
+    subs["uploadPlaylistId"] = get_upload_playlists(list(subs["channelId"]))
 
     return subs
 
 
-def get_upload_playlists(client: Resource, channeld_ids: list[str]) -> pd.Series:
+def get_upload_playlists(channeld_ids: list[str]) -> pd.Series:
     """Get the upload playlist IDs for a list of channel IDs.
 
+    The upload playlist ID is the channel ID with "UU" instead of the "UC" prefix, so it does not
+    need to be requested. Should a playlist not exist, it is skipped like any other missing
+    playlist (see `fetch_playlist_videos`).
+
     Args:
-        client (Resource): The YouTube API Resource.
         channeld_ids (list[str]): A list of all channel IDs to get the upload playlists for.
 
     Returns:
         pd.Series: The upload playlist IDs.
     """
-    # Retrieve the list of channels
-    resource = Wrapper(client.channels())  # type: ignore
-    items = resource.list_all(part="contentDetails", id=channeld_ids)
+    return pd.Series(["UU" + channel_id[2:] for channel_id in channeld_ids])
 
-    # This flattens the entire dictionary
-    df = pd.json_normalize(items)
-    return df["contentDetails.relatedPlaylists.uploads"]
 
+async def fetch_playlist_videos(
+    session: aiohttp.ClientSession,
+    playlist_id: str,
+    semaphore: asyncio.Semaphore,
+    cache: dict[str, dict],
+) -> list[dict]:
+    """Fetch all items of a playlist published in the last year.
 
-def get_videos(client: Resource, playlist_id: str) -> pd.DataFrame:
-    """Get all videos of a playlist published in the last year.
+    The year is calculated as 365 days before today. The API is called directly instead of through
+    the `Resource`, so that multiple playlists can be fetched concurrently.
 
-    The year is calculated as 365 days before today.
+    If the playlist is cached, the first page is requested with its ETag. When it did not change,
+    the cached items are used instead of fetching the remaining pages. The cache is updated
+    otherwise. Changes to later pages are not detected, so the items may contain videos that were
+    deleted since. The API leaves those out when requesting the durations.
 
     Args:
-        client (Resource): The YouTube API Resource.
+        session (aiohttp.ClientSession): The authorized HTTP session.
         playlist_id (str): The playlist ID.
+        semaphore (asyncio.Semaphore): Limits the number of concurrent requests.
+        cache (dict[str, dict]): The cached playlists from the last run.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the video IDs publish datetime and playlist ID.
+        list[dict]: The playlist items.
     """
-    last_year = date.today() - timedelta(365)
-
-    resource = Wrapper(client.playlistItems())  # type: ignore
+    # ISO 8601 dates can be compared as strings, which avoids parsing each datetime
+    last_year = (date.today() - timedelta(365)).isoformat()
+
+    def is_old(item: dict) -> bool:
+        return item["snippet"]["publishedAt"][:10] < last_year
+
+    params = {
+        "part": "snippet,contentDetails",
+        "playlistId": playlist_id,
+        "maxResults": 50,
+        # Only request the needed fields, which is a fraction of the complete items
+        "fields": "etag,nextPageToken,items(snippet/publishedAt,contentDetails/videoId)",
+    }
+    headers = {"If-None-Match": cache[playlist_id]["etag"]} if playlist_id in cache else {}
     items = []
-    # Iterate over each item to break early (better performance)
-    for item in resource.yield_all(part="snippet,contentDetails", playlistId=playlist_id):
-        if datetime.fromisoformat(item["snippet"]["publishedAt"]).date() < last_year:
-            # Assume videos are sorted newest to oldest (validated by simple test)
+    etag = None
+    while True:
+        async with semaphore, session.get(
+            f"{API_URL}/playlistItems", params=params, headers=headers
+        ) as resp:
+            if resp.status == 304:
+                # The playlist did not change since the last run
+                items = cache[playlist_id]["items"]
+                break
+            if resp.status == 404:
+                # Some playlists do not exist
+                return []
+            try:
+                resp.raise_for_status()
+            except aiohttp.ClientResponseError as e:
+                logging.error(e)
+                raise
+            res = orjson.loads(await resp.read())
+
+        if etag is None:
+            # Only the first page is compared to the cache
+            etag = res["etag"]
+            headers = {}
+        items.extend(res["items"])
+
+        # Do not request the next page if this one already reaches back further than a year
+        # Assume videos are sorted newest to oldest (validated by simple test)
+        if "nextPageToken" not in res or (items and is_old(items[-1])):
             break
-        items.append(item)
+        params["pageToken"] = res["nextPageToken"]
+
+    if etag is not None:
+        cache[playlist_id] = {"etag": etag, "items": items}
+
+    # Only keep the videos of the last year
+    for i, item in enumerate(items):
+        if is_old(item):
+            return items[:i]
+    return items
 
-    # This flattens the entire dictionary
-    df = pd.json_normalize(items)
-    if df.empty:
-        # Some playlists are empty
-        return df
 
-    videos = pd.DataFrame()
-    videos["videoId"] = df["contentDetails.videoId"]
-    videos["publishedAt"] = pd.to_datetime(df["snippet.publishedAt"])
-    videos["playlistId"] = playlist_id
+async def get_videos(
+    session: aiohttp.ClientSession,
+    playlist_ids: list[str],
+    semaphore: asyncio.Semaphore,
+    cache: dict[str, dict],
+) -> pd.DataFrame:
+    """Get all videos of the playlists published in the last year.
 
-    return videos
+    The year is calculated as 365 days before today. The playlists are fetched concurrently.
+
+    Args:
+        session (aiohttp.ClientSession): The authorized HTTP session.
+        playlist_ids (list[str]): The playlist IDs.
+        semaphore (asyncio.Semaphore): Limits the number of concurrent requests.
+        cache (dict[str, dict]): The cached playlists from the last run.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing the video IDs publish datetime and playlist ID.
+            The videos of each playlist are contiguous.
+    """
+    playlists = await tqdm.gather(
+        *(
+            fetch_playlist_videos(session, playlist_id, semaphore, cache)
+            for playlist_id in playlist_ids
+        ),
+        desc="Get upload playlists",
+        bar_format=BAR_FORMAT,
+        mininterval=BAR_MININTERVAL,
+    )
+
+    # Build the columns of all playlists at once instead of concatenating a DataFrame for each
+    video_ids, published = PLAYLIST_ITEM_EXTRACTOR([item for items in playlists for item in items])
+    # Categorical codes are much smaller than repeating the ID string for every video
+    codes = np.repeat(np.arange(len(playlist_ids)), [len(items) for items in playlists])
+    return pd.DataFrame(
+        {
+            "videoId": video_ids,
+            # The API always returns ISO 8601, so the format does not need to be inferred
+            "publishedAt": pd.to_datetime(published, format="ISO8601", utc=True, cache=True),
+            "playlistId": pd.Categorical.from_codes(codes, categories=playlist_ids),
+        }
+    )
 
 
-def get_video_durations(client: Resource, video_ids: list[str]) -> pd.Series:
+async def fetch_video_durations(
+    session: aiohttp.ClientSession, video_ids: list[str], semaphore: asyncio.Semaphore
+) -> dict[str, str]:
+    """Fetch the ISO 8601 durations of up to 50 videos.
+
+    Deleted or private videos are left out by the API.
+
+    Args:
+        session (aiohttp.ClientSession): The authorized HTTP session.
+        video_ids (list[str]): The video IDs. At most 50 IDs fit into one request.
+        semaphore (asyncio.Semaphore): Limits the number of concurrent requests.
+
+    Returns:
+        dict[str, str]: The video durations, keyed by the video ID.
+    """
+    params = {
+        "part": "contentDetails",
+        "id": ",".join(video_ids),
+        "maxResults": 50,
+        "fields": "items(id,contentDetails/duration)",
+    }
+    async with semaphore, session.get(f"{API_URL}/videos", params=params) as resp:
+        if resp.status == 404:
+            return {}
+        try:
+            resp.raise_for_status()
+        except aiohttp.ClientResponseError as e:
+            logging.error(e)
+            raise
+        res = orjson.loads(await resp.read())
+
+    return dict(zip(*VIDEO_DURATION_EXTRACTOR(res["items"])))
+
+
+async def get_video_durations(
+    session: aiohttp.ClientSession, video_ids: list[str], semaphore: asyncio.Semaphore
+) -> pd.Series:
     """Get the video durations given a list of video IDs.
 
+    The IDs are split into requests of 50 IDs, which are sent concurrently. Deleted or private
+    videos are left out by the API.
+
     Args:
-        client (Resource): The YouTube API Resource.
+        session (aiohttp.ClientSession): The authorized HTTP session.
         video_ids (list[str]): The list of video IDs.
+        semaphore (asyncio.Semaphore): Limits the number of concurrent requests.
 
     Returns:
-        pd.Series: The video durations.
+        pd.Series: The video durations in seconds, indexed by the video ID.
     """
-    resource = Wrapper(client.videos())  # type: ignore
-    items = resource.list_all(
-        part="contentDetails",
-        id=video_ids,
-        progress_bar=True,
+    chunks = await tqdm.gather(
+        *(
+            fetch_video_durations(session, video_ids[i : i + 50], semaphore)
+            for i in range(0, len(video_ids), 50)
+        ),
         desc="Get video durations",
+        unit_scale=50,
+        bar_format=BAR_FORMAT,
+        mininterval=BAR_MININTERVAL,
     )
 
-    # This flattens the entire dictionary
-    df = pd.json_normalize(items)
-    return pd.to_timedelta(df["contentDetails.duration"])
+    durations = pd.Series(
+        {video_id: duration for chunk in chunks for video_id, duration in chunk.items()},
+        dtype=str,
+    )
+    # A single regex scan is faster than parsing each ISO 8601 duration on its own
+    parts = durations.str.extract(DURATION_PATTERN).fillna(0).astype(np.int32)
+    seconds = parts[0] * 86400 + parts[1] * 3600 + parts[2] * 60 + parts[3]
+    # Seconds are enough for summing up and take half the memory of timedeltas
+    return seconds.astype(np.int32).rename("duration")
 
 
 def aggregate_uploads(videos: pd.DataFrame) -> pd.DataFrame:
@@ -125,49 +285,88 @@ def aggregate_uploads(videos: pd.DataFrame) -> pd.DataFrame:
     first and last video.
 
     Args:
-        videos (pd.DataFrame): The videos. Need to have a 'playlistId', 'duration' and 'publishedAt'
-            column.
+        videos (pd.DataFrame): The videos. Need to have a 'playlistId', 'duration' (in seconds) and
+            'publishedAt' column.
 
     Returns:
         pd.DataFrame: The aggregated data.
     """
-    agg = pd.DataFrame()
-    agg[["videoCount", "contentLength"]] = videos.groupby("playlistId")["duration"].agg(
-        ["count", "sum"]
+    if videos.empty:
+        return pd.DataFrame(
+            columns=["videoCount", "contentLength", "firstPublished", "lastPublished"]
+        )
+
+    # The videos of each playlist are contiguous (see `get_videos`), so each group is a run of
+    # rows and can be reduced in a single linear pass without hashing the playlist IDs
+    playlist_ids = videos["playlistId"].astype("category")
+    codes = playlist_ids.cat.codes.to_numpy()
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+
+    durations = videos["duration"]
+    published = videos["publishedAt"].to_numpy(dtype="datetime64[ns]").view("i8")
+    return pd.DataFrame(
+        {
+            # Count and sum like pandas, which skips missing durations
+            "videoCount": np.add.reduceat(durations.notna().to_numpy(dtype="i8"), starts),
+            "contentLength": np.add.reduceat(durations.fillna(0).to_numpy(dtype="i8"), starts),
+            "firstPublished": pd.to_datetime(np.minimum.reduceat(published, starts), utc=True),
+            "lastPublished": pd.to_datetime(np.maximum.reduceat(published, starts), utc=True),
+        },
+        index=pd.Index(playlist_ids.cat.categories[codes[starts]], name="playlistId"),
     )
-    agg[["firstPublished", "lastPublished"]] = videos.groupby("playlistId")["publishedAt"].agg(
-        ["min", "max"]
-    )
-
-    return agg
 
 
-if __name__ == "__main__":
+async def main_async():
+    """Calculate the average content length per day of all subscriptions."""
     # Get credentials
     creds = auth()
 
     # Create a YouTube API client
-    youtube = googleapiclient.discovery.build("youtube", "v3", credentials=creds)
+    # A single HTTP object is shared by all requests, so the connection is kept alive
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(cache=None))
+    youtube = googleapiclient.discovery.build("youtube", "v3", http=http, model=OrjsonModel())
 
     # Get all subscribed channels
     subs = get_subscriptions(youtube)
 
-    # Get all videos
-    videos = pd.DataFrame()
-    for playlist_id in tqdm(
-        subs["uploadPlaylistId"], desc="Get upload playlists", bar_format=BAR_FORMAT
-    ):
-        videos = pd.concat([videos, get_videos(youtube, playlist_id)], ignore_index=True)
+    # The aiohttp session does not refresh the token, so it must not expire during the run
+    # The expiry is a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    if creds.expiry is not None and creds.expiry - now < TOKEN_MIN_LIFETIME:
+        creds.refresh(Request())
 
-    # Get video durations
-    videos["duration"] = get_video_durations(youtube, list(videos["videoId"]))
+    # Get all videos
+    cache = load_cache()
+    semaphore = asyncio.Semaphore(MAX_CONNECTIONS)
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS),
+        headers={"Authorization": f"Bearer {creds.token}"},
+    ) as session:
+        videos = await get_videos(session, list(subs["uploadPlaylistId"]), semaphore, cache)
+        # Only keep the playlists which are still subscribed to
+        save_cache(
+            {
+                playlist_id: cache[playlist_id]
+                for playlist_id in subs["uploadPlaylistId"]
+                if playlist_id in cache
+            }
+        )
+
+        # Get video durations
+        # Match them by ID, as the API leaves out deleted or private videos
+        durations = await get_video_durations(session, list(videos["videoId"]), semaphore)
+        videos["duration"] = videos["videoId"].map(durations)
 
     # Aggregate data for playlists
     subs = subs.join(aggregate_uploads(videos), on="uploadPlaylistId")
 
     # Calculate average content length
-    avg_content = (subs["contentLength"].sum() / 365).total_seconds()
+    avg_content = subs["contentLength"].sum() / 365
     print(
         "Avg. content length per day: "
         f"{avg_content // 3600:.0f} hours {round(avg_content % 3600 / 60)} minutes"
     )
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
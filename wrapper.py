@@ -7,19 +7,69 @@
 
 import logging
 import math
-from typing import Generator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Generator
 
+import orjson
+import pandas as pd
 from googleapiclient.discovery import Resource
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
 from tqdm import tqdm, trange
 
 BAR_FORMAT = "{l_bar}{bar}| [{remaining}]"
+# Minimum seconds between progress bar refreshes, as each refresh writes to stderr
+BAR_MININTERVAL = 0.5
+
+
+def make_extractor(paths: list[tuple[str, ...]]) -> Callable[[list[dict]], tuple[list, ...]]:
+    """Create a function which extracts fields from a list of items.
+
+    The function is generated with the paths inlined, e.g. for the paths
+    `[("snippet", "title")]` it is equivalent to
+    `lambda items: ([item["snippet"]["title"] for item in items],)`.
+    This avoids looking up the keys of each path for every item.
+
+    Args:
+        paths (list[tuple[str, ...]]): The keys leading to each field.
+
+    Returns:
+        Callable[[list[dict]], tuple[list, ...]]: The function, which returns
+            a list of values for each path.
+    """
+    columns = "".join(
+        "[item" + "".join(f"[{key!r}]" for key in path) + " for item in items], "
+        for path in paths
+    )
+    namespace: dict[str, Callable] = {}
+    exec(f"def extract(items):\n    return ({columns})\n", namespace)
+    return namespace["extract"]
+
+
+class OrjsonModel(JsonModel):
+    """`googleapiclient.model.JsonModel` which parses the responses with `orjson`.
+
+    `orjson` is considerably faster than the standard `json` module.
+    """
+
+    def deserialize(self, content: bytes | str) -> dict:
+        """Parses the response body.
+
+        Args:
+            content (bytes | str): The response body.
+
+        Returns:
+            dict: The parsed response.
+        """
+        return orjson.loads(content)
 
 
 class Wrapper:
     """Wrapper for `googleapiclient.discovery.Resource`.
 
-    Adds docstrings and annotations and the `yield_all` and `list_all` methods.
+    Adds docstrings and annotations and the `yield_pages`, `yield_all`, `list_all` and
+    `list_projected` methods.
     """
 
     def __init__(self, resource: Resource):
@@ -43,29 +93,40 @@ class Wrapper:
 
         self._resource = resource
 
-    def _yield_all(self, progress_bar=False, desc="", **kwargs) -> Generator[dict, None, None]:
-        """Generator which yields the items from all pages.
+    def _yield_pages(
+        self, progress_bar=False, desc="", **kwargs
+    ) -> Generator[list[dict], None, None]:
+        """Generator which yields the items of each page.
 
-        This function will request each page from the API and yield each
-        item after another.
+        This function will request each page from the API and yield its
+        items. The next page is already requested while the items of the
+        current page are consumed.
 
         Yields:
-            Generator[dict, None, None]: The items.
+            Generator[list[dict], None, None]: The items of each page.
         """
         kwargs.update(maxResults=50)
         req = self._resource.list(**kwargs)  # type: ignore
         try:
-            with tqdm(disable=not progress_bar, bar_format=BAR_FORMAT, desc=desc) as pbar:
-                while req is not None:
-                    res = req.execute()
+            # A single worker executes all requests, as the HTTP object is not thread-safe
+            # Only create the progress bar if needed
+            with ThreadPoolExecutor(max_workers=1) as pool, (
+                tqdm(bar_format=BAR_FORMAT, mininterval=BAR_MININTERVAL, desc=desc)
+                if progress_bar
+                else nullcontext()
+            ) as pbar:
+                future = pool.submit(req.execute)
+                while future is not None:
+                    res = future.result()
 
-                    pbar.total = math.ceil(res["pageInfo"]["totalResults"] / 50)
-                    pbar.update()
+                    req = self._resource.list_next(req, res)  # type: ignore
+                    future = pool.submit(req.execute) if req is not None else None
 
-                    for item in res["items"]:
-                        yield item
+                    if pbar is not None:
+                        pbar.total = math.ceil(res["pageInfo"]["totalResults"] / 50)
+                        pbar.update()
 
-                    req = self._resource.list_next(req, res)  # type: ignore
+                    yield res["items"]
 
         except HttpError as e:
             if e.status_code == 404:
@@ -73,11 +134,13 @@ class Wrapper:
             logging.error(e)
             raise
 
-    def yield_all(self, progress_bar=False, desc="", **kwargs) -> Generator[dict, None, None]:
-        """Generator which yields the items from all pages.
+    def yield_pages(
+        self, progress_bar=False, desc="", **kwargs
+    ) -> Generator[list[dict], None, None]:
+        """Generator which yields the items of each page.
 
-        This function will request each page from the API and yield each
-        item after another.
+        This function will request each page from the API and yield its
+        items.
 
         Args:
             progress_bar (bool, optional): If a progress bar should be shown.
@@ -88,7 +151,7 @@ class Wrapper:
                 See the resource's `list` method.
 
         Yields:
-            Generator[dict, None, None]: The items.
+            Generator[list[dict], None, None]: The items of each page.
         """
         if "id" in kwargs and len(kwargs["id"]) > 50:
             # If more than 50 ID's are requested, they need to be split into
@@ -102,11 +165,32 @@ class Wrapper:
                 disable=not progress_bar,
                 desc=desc,
                 bar_format=BAR_FORMAT,
+                mininterval=BAR_MININTERVAL,
             ):
                 # This should most likely be only one page
-                yield from self._yield_all(**kwargs, id=ids[i : i + 50])
+                yield from self._yield_pages(**kwargs, id=ids[i : i + 50])
         else:
-            yield from self._yield_all(**kwargs, progress_bar=progress_bar, desc=desc)
+            yield from self._yield_pages(**kwargs, progress_bar=progress_bar, desc=desc)
+
+    def yield_all(self, **kwargs) -> Generator[dict, None, None]:
+        """Generator which yields the items from all pages.
+
+        This function will request each page from the API and yield each
+        item after another.
+
+        Args:
+            progress_bar (bool, optional): If a progress bar should be shown.
+                Defaults to False.
+            desc (str, optional): The description to the progess bar.
+                Defaults to "".
+            kwargs (dict[str, Unknown]): Arguments for the request.
+                See the resource's `list` method.
+
+        Yields:
+            Generator[dict, None, None]: The items.
+        """
+        for page in self.yield_pages(**kwargs):
+            yield from page
 
     def list_all(self, **kwargs) -> list[dict]:
         """List with the items from all pages.
@@ -126,3 +210,33 @@ class Wrapper:
             list[dict]: The items.
         """
         return list(self.yield_all(**kwargs))
+
+    def list_projected(
+        self, extractor: Callable[[list[dict]], tuple[list, ...]], columns: list[str], **kwargs
+    ) -> pd.DataFrame:
+        """DataFrame with the projected items from all pages.
+
+        This function will request each page from the API and only keep the
+        fields extracted from each page, instead of collecting each item.
+
+        Args:
+            extractor (Callable[[list[dict]], tuple[list, ...]]): Extracts the
+                fields of the items, in the same order as `columns`.
+                See `make_extractor`.
+            columns (list[str]): The column names of the extracted fields.
+            progress_bar (bool, optional): If a progress bar should be shown.
+                Defaults to False.
+            desc (str, optional): The description to the progess bar.
+                Defaults to "".
+            kwargs (dict[str, Unknown]): Arguments for the request.
+                See the resource's `list` method.
+
+        Returns:
+            pd.DataFrame: The extracted fields.
+        """
+        cols: list[list] = [[] for _ in columns]
+        for page in self.yield_pages(**kwargs):
+            for col, values in zip(cols, extractor(page)):
+                col.extend(values)
+
+        return pd.DataFrame(dict(zip(columns, cols)), copy=False)